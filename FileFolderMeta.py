@@ -4,34 +4,87 @@ Calculate metadata from file(s) / folder(s) nested within a given path
 '''
 
 # standard imports
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from hashlib import md5, sha1, sha256
-from io import BytesIO
-from json import dump as jdump
+from io import BufferedWriter, BytesIO, TextIOWrapper
+from json import dumps as jdumps
+from operator import attrgetter
+from os.path import basename, isdir, splitext
 from pathlib import Path
+from shutil import copyfileobj
+from stat import S_ISREG
 from sys import stderr
+from time import localtime
 from warnings import warn
+from zipfile import is_zipfile
 from zlib import crc32
 import argparse
 import gzip
 import lzma
+import os
+import tarfile
 
 # useful constants
 __version__ = '0.0.16'
 TIMESTAMP_FORMAT_STRING = "%Y-%m-%d %H:%M:%S"
 COMPRESSED_EXTENSIONS = {'GZ', 'XZ'}
-
-# hash functionto calculate
+HASH_CHUNK_SIZE = 1048576 # 1 MiB
+HASH_TILE_SIZE = 524288 # 512 KiB (total size of small files to hash per parallel task)
+HASH_HUGE_CHUNK_SIZE = 4194304 # 4 MiB (files larger than `HASH_HUGE_FILE_SIZE` are read in chunks of this size, and evicted from the page cache as they're hashed)
+OUTPUT_BUFFER_SIZE = 1048576 # 1 MiB (the JSON output is written in many small pieces)
+OUTPUT_GZIP_COMPRESSLEVEL = 1 # much faster than the default (9) for only slightly larger output
+SNIFF_SIZE = 65536 # 64 KiB (enough to cover the ISO Primary Volume Descriptor at LBA 16 in every known sector layout)
+try:
+    HASH_HUGE_FILE_SIZE = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2 # half of RAM
+except:
+    HASH_HUGE_FILE_SIZE = None # unable to determine RAM size (e.g. Windows), so never treat files as huge
+CRC32_FUNCTION = crc32 # signature `(data, value)`; replaced below by a faster implementation if available
+
+# class to compute a running CRC32 with the same interface as the `hashlib` hashers
+class CRC32:
+    __slots__ = ('value',)
+    def __init__(self):
+        self.value = 0
+    def update(self, data):
+        self.value = CRC32_FUNCTION(data, self.value)
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+# hash functions to calculate (each maps to a constructor of an object with `update` and `hexdigest`)
 HASH_FUNCTIONS = {
-    'crc32': lambda x: '0x' + f'{crc32(x):08x}',
-    'md5': lambda x: '0x' + md5(x).hexdigest(),
-    'sha1': lambda x: '0x' + sha1(x).hexdigest(),
-    'sha256': lambda x: '0x' + sha256(x).hexdigest(),
+    'crc32': CRC32,
+    'md5': md5,
+    'sha1': sha1,
+    'sha256': sha256,
 }
+DEFAULT_HASHES = tuple(sorted(HASH_FUNCTIONS.keys())) # hashes to calculate by default (optional ones added below aren't calculated unless requested)
+HASH_NAMES = DEFAULT_HASHES # hashes to actually compute (precomputed so it isn't re-sorted for every file)
+HASH_CONSTRUCTORS = tuple(HASH_FUNCTIONS[k] for k in HASH_NAMES) # parallel to `HASH_NAMES`
+
+EMPTY_HASHES = None # hashes of empty data (so empty in-memory files don't need to be hashed); initialized by `set_hashes`
+
+# set which hash functions to calculate (can be empty to not calculate any)
+def set_hashes(names):
+    global HASH_NAMES, HASH_CONSTRUCTORS, EMPTY_HASHES
+    HASH_NAMES = tuple(sorted(names))
+    HASH_CONSTRUCTORS = tuple(HASH_FUNCTIONS[k] for k in HASH_NAMES)
+    EMPTY_HASHES = hash_all(data=b'')
+
+# format a `datetime` as a string in the `TIMESTAMP_FORMAT_STRING` format (much faster than `strftime`, which is called for every file)
+def format_datetime(dt):
+    if dt.year < 1000: # `strftime` doesn't zero-pad years on all platforms, so keep its output for these
+        return dt.strftime(TIMESTAMP_FORMAT_STRING)
+    return f'{dt.year}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}'
+
+# format a POSIX timestamp (e.g. `st_mtime`) as a string in local time in the `TIMESTAMP_FORMAT_STRING` format
+# (straight from the `time.localtime` fields without building a `datetime`; `datetime.fromtimestamp` rounds to microseconds, so round up the same times)
+def format_timestamp(t):
+    return '%d-%02d-%02d %02d:%02d:%02d' % localtime(t + 1 if (t % 1) >= 0.9999995 else t)[:6]
 
 # return the current time as a string
 def get_time():
-    return datetime.now().strftime(TIMESTAMP_FORMAT_STRING)
+    return format_datetime(datetime.now())
 
 # print log message
 def print_log(s='', end='\n', file=stderr):
@@ -60,160 +113,412 @@ try:
 except:
     warn("Unable to import 'niemafs.WiiFS' (likely due to missing dependencies). Wii support disabled.")
     WiiFS = None
+try:
+    from niemafs.iso import COMMON_LAYOUT_CANDIDATES as ISO_LAYOUTS
+except:
+    ISO_LAYOUTS = None # unknown layouts, so don't sniff ISOs (just try to parse them)
+try:
+    import orjson
+except:
+    orjson = None # 'orjson' is optional, so just use the standard `json` module
+try:
+    from isal import igzip as gzip_output # Intel ISA-L's SIMD-accelerated DEFLATE (same interface as `gzip`)
+except:
+    gzip_output = gzip # 'isal' is optional, so just use the standard `gzip` module
+def get_fastcrc_crc32(): # PCLMULQDQ-accelerated CRC-32/ISO-HDLC (same polynomial as `zlib.crc32`)
+    from fastcrc import crc32 as fastcrc_crc32
+    return lambda data, value: fastcrc_crc32.iso_hdlc(data, value)
+def get_isal_crc32(): # Intel ISA-L's SIMD-accelerated CRC32 (same interface as `zlib.crc32`)
+    from isal.isal_zlib import crc32 as isal_crc32
+    return isal_crc32
+for get_crc32_function in [get_fastcrc_crc32, get_isal_crc32]: # in order of preference
+    try:
+        crc32_function = get_crc32_function()
+        if crc32_function(memoryview(b'456'), crc32_function(memoryview(b'123'), 0)) == crc32(b'123456'): # running CRC32 must match zlib
+            CRC32_FUNCTION = crc32_function
+            break
+    except:
+        pass # these are optional, so just keep using `zlib.crc32` if none work
+try:
+    from blake3 import blake3
+    HASH_FUNCTIONS['blake3'] = blake3 # SIMD-accelerated (much faster than SHA-256); single-threaded, as its thread pool wouldn't survive forking `-j` worker processes
+except:
+    pass # 'blake3' is optional, so just don't offer it
+
+# compute all hashes (as a `tuple` parallel to `HASH_NAMES`) in a single pass over `data` (bytes-like) or the file at `path` (streamed in chunks)
+def hash_all(path=None, data=None):
+    if len(HASH_CONSTRUCTORS) == 0: # no hashes to calculate, so don't even open the file
+        return tuple()
+    hashers = [func() for func in HASH_CONSTRUCTORS]
+    updates = [h.update for h in hashers] # bind once instead of looking up `update` for every chunk
+    if data is None:
+        with open(path, 'rb', buffering=0) as f:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            for update in updates:
+                update(chunk)
+            if len(chunk) == HASH_CHUNK_SIZE: # large file: read the rest into one reused buffer (not memory-mapped, as a file that shrinks while mapped would crash with SIGBUS)
+                fd = f.fileno()
+                huge = (HASH_HUGE_FILE_SIZE is not None) and (os.fstat(fd).st_size > HASH_HUGE_FILE_SIZE) # would fill up much of the page cache
+                if hasattr(os, 'posix_fadvise'): # tell the kernel we'll read sequentially (larger readahead window)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                buf = bytearray(HASH_HUGE_CHUNK_SIZE if huge else HASH_CHUNK_SIZE)
+                view = memoryview(buf)
+                offset = HASH_CHUNK_SIZE
+                while (num_bytes := f.readinto(buf)):
+                    if huge and hasattr(os, 'posix_fadvise'): # ask the kernel to start reading the next range while this one is being hashed
+                        os.posix_fadvise(fd, offset + num_bytes, HASH_HUGE_CHUNK_SIZE, os.POSIX_FADV_WILLNEED)
+                    with view[:num_bytes] as chunk:
+                        for update in updates:
+                            update(chunk)
+                    if huge and hasattr(os, 'posix_fadvise'): # evict each range of a huge file from the page cache once it's hashed
+                        os.posix_fadvise(fd, offset, num_bytes, os.POSIX_FADV_DONTNEED)
+                    offset += num_bytes
+                if hasattr(os, 'posix_fadvise'): # we won't read this file again, so don't let it push other data out of the page cache
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            else: # small file (the common case): likely already fully read, so avoid allocating a buffer
+                while (chunk := f.read(HASH_CHUNK_SIZE)):
+                    for update in updates:
+                        update(chunk)
+    elif len(data) <= HASH_CHUNK_SIZE:
+        for update in updates:
+            update(data)
+    else: # large in-memory data (e.g. archive members): feed the hashers chunk-sized views, so each chunk is still in cache for every hasher
+        with memoryview(data) as view:
+            for start in range(0, len(view), HASH_CHUNK_SIZE):
+                with view[start : start + HASH_CHUNK_SIZE] as chunk:
+                    for update in updates:
+                        update(chunk)
+    return tuple([f'0x{h.hexdigest()}' for h in hashers])
+
+# compute the hashes of multiple files on disk (e.g. one task for a worker process)
+def hash_all_paths(paths):
+    return [hash_all(path=path) for path in paths]
+set_hashes(HASH_NAMES)
 
 # clean a file extension
 def clean_ext(ext):
     return ext.replace('.','').strip().upper()
 
-# decompress a data stream, or return it if already decompressed
-def decompress(path, data):
-    ext = clean_ext(path.suffix)
+# get the cleaned file extension of a path (`str`)
+def get_ext(path):
+    return clean_ext(splitext(path)[1])
+
+# open a file-like object of the (decompressed) data of a file, from `data` if given (otherwise from `path`); compressed data is decompressed as it's read
+def open_decompressed(path, data=None):
+    ext = get_ext(path)
     if ext == 'GZ':
-        return gzip.decompress(data)
+        return gzip.open(path if data is None else BytesIO(data), 'rb')
     elif ext == 'XZ':
-        return lzma.decompress(data)
+        return lzma.open(path if data is None else BytesIO(data), 'rb')
+    elif data is None:
+        return open(path, 'rb')
     else:
-        return data
+        return BytesIO(data)
+
+# read the first `size` bytes of the (decompressed) data of a file (compressed files are only decompressed as far as needed)
+def read_header(path, data=None, size=SNIFF_SIZE):
+    if (data is not None) and (get_ext(path) not in COMPRESSED_EXTENSIONS):
+        return data[:size]
+    with open_decompressed(path, data=data) as f:
+        return f.read(size)
+
+# get the `dict` representations of the children of `obj` as a `list`, or as a generator if `lazy`
+def get_children_dicts(obj, lazy=False):
+    children = (child.to_dict(lazy=True) for child in obj)
+    if lazy:
+        return children
+    return list_children_dicts(children)
+
+# consume a generator of lazy child `dict`s into a `list`, recursively replacing lazy `children` with `list`s
+# (iterative with an explicit stack of unfinished generators, so arbitrarily deep trees don't hit the recursion limit)
+def list_children_dicts(children):
+    out = list()
+    stack = [(children, out)]
+    while stack:
+        for child in stack[-1][0]:
+            stack[-1][1].append(child)
+            if hasattr(child.get('children'), '__next__'):
+                grandchildren = child['children']
+                child['children'] = list()
+                stack.append((grandchildren, child['children']))
+                break
+        else:
+            stack.pop()
+    return out
+
+# serialize `obj` (which must not contain any generators) in the same format as `json.dumps`, using orjson if possible
+def dumps_json(obj, indent=None, sort_keys=False):
+    if (orjson is not None) and (indent == '  '): # orjson only supports 2-space indents
+        try:
+            out = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+            if out.isascii() and (b'\x7f' not in out): # otherwise, need `json.dumps` to escape non-ASCII characters and DEL (which orjson writes raw)
+                return out.decode()
+        except:
+            pass # e.g. integers that don't fit in 64 bits
+    return jdumps(obj, indent=indent, sort_keys=sort_keys)
+
+# write `obj` to `out` in the same format as `json.dump`, but consume generators (e.g. lazy `children`) as they're written
+# (iterative with an explicit stack of open containers, so arbitrarily deep trees don't hit the recursion limit)
+def write_json(obj, out, indent=None, sort_keys=False):
+    if (indent is not None) and (not isinstance(indent, str)):
+        indent = ' ' * indent
+    stack = list() # [items, end, newline, inner_newline, empty] of each container that's still being written
+    while True:
+        # write the start of `obj` (or all of it if it has no lazy parts)
+        if isinstance(obj, dict):
+            if not any(hasattr(v, '__next__') for v in obj.values()): # nothing lazy (e.g. a file), so serialize in a single call
+                tmp = dumps_json(obj, indent=indent, sort_keys=sort_keys)
+                if indent is not None:
+                    tmp = tmp.replace('\n', '\n' + (indent * len(stack)))
+                out.write(tmp)
+            else:
+                out.write('{')
+                items = iter(sorted(obj.items()) if sort_keys else obj.items())
+                newline = '' if indent is None else ('\n' + (indent * len(stack)))
+                stack.append([items, '}', newline, newline + ('' if indent is None else indent), True])
+        elif isinstance(obj, (list, tuple)) or hasattr(obj, '__next__'):
+            out.write('[')
+            items = ((None, v) for v in obj)
+            newline = '' if indent is None else ('\n' + (indent * len(stack)))
+            stack.append([items, ']', newline, newline + ('' if indent is None else indent), True])
+        else:
+            out.write(jdumps(obj))
+
+        # move on to the next item of the innermost open container, closing any containers that are finished
+        item_sep = ', ' if indent is None else ','
+        while stack:
+            curr = stack[-1]
+            try:
+                k, obj = next(curr[0])
+            except StopIteration:
+                stack.pop()
+                if not curr[4]:
+                    out.write(curr[2])
+                out.write(curr[1])
+                continue
+            out.write(curr[3] if curr[4] else (item_sep + curr[3]))
+            curr[4] = False
+            if k is not None:
+                out.write(jdumps(k) + ': ')
+            break
+        else:
+            return
 
 # class to represent the most generalized of entities (superclass of all other classes)
 class FFM_Entity:
+    __slots__ = ('name', 'data')
     def __init__(self, name, data=None):
         self.name = name
-        self.data = data # initialize upon first `get_data` call if `None`
-    def to_dict(self):
+        self.data = data # in-memory contents (e.g. archive members), or `None` if on disk (files on disk are streamed, never read into memory)
+    def to_dict(self, lazy=False): # `lazy` = `True` to return `children` as a generator of child `dict`s (e.g. for `write_json`)
         return {'name': self.name}
 
-# class to represent files and directories on disk
+# class to represent files and directories on disk (`path` is a `str`, which is much faster than `pathlib.Path` in the hot paths)
 class FFM_OnDisk(FFM_Entity):
+    __slots__ = ('path',)
     def __init__(self, path, data=None):
-        super().__init__(name=path.name, data=data)
+        super().__init__(name=basename(path), data=data)
         self.path = path
-    def to_dict(self):
-        return super().to_dict()
+    def to_dict(self, lazy=False):
+        return super().to_dict(lazy=lazy)
 
 # class to represent directories
 class FFM_Directory(FFM_OnDisk):
+    __slots__ = ('children',)
     def __init__(self, path):
         super().__init__(path=path, data=None)
         self.children = None # initialize upon first `__iter__` call
     def __iter__(self):
         if self.children is None:
-            self.children = sorted((get_obj(p) for p in self.path.glob('*')), key=lambda x: x.name)
+            with os.scandir(self.path) as entries:
+                entries = sorted(entries, key=attrgetter('name'))
+            if GET_OBJ_EXECUTOR is None:
+                self.children = [get_obj(entry.path, dir_entry=entry) for entry in entries]
+            else: # trial-parse possible archives in parallel (everything else is cheap, so just do it here)
+                self.children = [GET_OBJ_EXECUTOR.submit(get_obj, entry.path, dir_entry=entry) if (get_suffix_class(entry.name) is not None) else get_obj(entry.path, dir_entry=entry) for entry in entries]
+                self.children = [child.result() if isinstance(child, Future) else child for child in self.children]
         return iter(self.children)
-    def to_dict(self):
-        return super().to_dict() | {
+    def to_dict(self, lazy=False):
+        return super().to_dict(lazy=lazy) | {
             'format': 'DIR',
-            'children': [child.to_dict() for child in self],
+            'children': get_children_dicts(self, lazy=lazy),
         }
 
 # class to represent arbitrary files (last resort if type-specific class doesn't exist)
 class FFM_File(FFM_OnDisk):
+    __slots__ = ('stat_result', 'create_time', 'mod_time', 'size', 'hashes')
     def __init__(self, path, data=None):
         super().__init__(path=path, data=data)
         self.stat_result = None # initialize upon first `stat` call
         self.create_time = None # initialize upon first call to `get_create_time` call
         self.mod_time = None # initialize upon first `get_mod_time` call
-    def get_data(self):
-        if self.data is None:
-            with open(self.path, 'rb') as self_f:
-                self.data = self_f.read()
-        return self.data
+        self.size = None # initialize upon first `get_size` call
+        self.hashes = None # initialize upon first `get_hashes` call (`tuple` parallel to `HASH_NAMES`, rather than a `dict` per file)
     def get_size(self):
-        return len(self.get_data())
+        if self.size is None:
+            if self.data is None:
+                self.size = self.stat().st_size
+                if (self.size == 0) and S_ISREG(self.stat().st_mode): # e.g. procfs/sysfs files report size 0 but have content, so count the bytes
+                    with open(self.path, 'rb') as self_f:
+                        while (chunk := self_f.read(HASH_CHUNK_SIZE)):
+                            self.size += len(chunk)
+            else:
+                self.size = len(self.data)
+        return self.size
+    def get_hashes(self):
+        if self.hashes is None:
+            if (self.data is not None) and (len(self.data) == 0): # files on disk are always read (their reported size might be wrong)
+                self.hashes = EMPTY_HASHES
+            else:
+                self.hashes = hash_all(path=self.path, data=self.data)
+        return self.hashes
     def stat(self):
         if self.stat_result is None:
-            self.stat_result = self.path.stat()
+            self.stat_result = os.stat(self.path)
         return self.stat_result
     def get_create_time(self):
         if self.create_time == '': # '' denotes an intentionally blank time (e.g. file systems that don't have timestamps)
             return None
         if self.create_time is None:
-            self.create_time = datetime.fromtimestamp(self.stat().st_ctime).astimezone().strftime(TIMESTAMP_FORMAT_STRING)
+            self.create_time = format_timestamp(self.stat().st_ctime)
         return self.create_time
     def get_mod_time(self):
         if self.mod_time == '': # '' denotes an intentionally blank time (e.g. file systems that don't have timestamps)
             return None
         if self.mod_time is None:
-            self.mod_time = datetime.fromtimestamp(self.stat().st_mtime).astimezone().strftime(TIMESTAMP_FORMAT_STRING)
+            self.mod_time = format_timestamp(self.stat().st_mtime)
         return self.mod_time
-    def to_dict(self):
-        out = super().to_dict() | {
-            'format': 'FILE',
-            'size': self.get_size(),
-        } | {k:HASH_FUNCTIONS[k](self.get_data()) for k in sorted(HASH_FUNCTIONS.keys())}
-        for k, func in [('create_time',self.get_create_time), ('mod_time',self.get_mod_time)]:
-            v = func()
-            if v is not None:
-                out[k] = v
+    def to_dict(self, lazy=False):
+        out = super().to_dict(lazy=lazy)
+        out['format'] = 'FILE'
+        out['size'] = self.get_size()
+        out.update(zip(HASH_NAMES, self.get_hashes()))
+        self.data = None # size and hashes are cached, so no need to keep the data in memory
+        create_time = self.get_create_time()
+        if create_time is not None:
+            out['create_time'] = create_time
+        mod_time = self.get_mod_time()
+        if mod_time is not None:
+            out['mod_time'] = mod_time
         return out
 
 # class to represent NiemaFS-based classes
 class FFM_NiemaFS(FFM_File):
+    __slots__ = ('children', 'format', 'fs', 'format_attributes')
     def __init__(self, fmt, path, data=None):
         super().__init__(path=path, data=data)
         self.children = None # initialize upon first `__iter__` call
         self.format = fmt
         self.fs = None
+        self.format_attributes = None # initialize upon first `get_format_attributes` call
+
+    # cheaply check if the first `SNIFF_SIZE` bytes of the (decompressed) data of the file at `path` (or `data`) could be this format (before fully parsing it)
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return True
+
+    # return a file-like object of the (decompressed) data (uncompressed files on disk are read as they're parsed instead of read into memory)
+    # (not memory-mapped, as a file that shrinks while mapped would crash with SIGBUS)
+    def get_file_obj(self):
+        if get_ext(self.path) not in COMPRESSED_EXTENSIONS:
+            if self.data is not None:
+                return BytesIO(self.data)
+            file_obj = open(self.path, 'rb')
+            if hasattr(os, 'posix_fadvise') and (HASH_HUGE_FILE_SIZE is not None) and (self.get_size() <= HASH_HUGE_FILE_SIZE):
+                # ask the kernel to start reading the archive in the background while it's being parsed (not huge ones, which would flood the page cache)
+                os.posix_fadvise(file_obj.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return file_obj
+        # compressed: niemafs needs random access (which decompressing streams can only do by rewinding), so decompress into memory, but in chunks
+        # (rather than with a single `read`, which would briefly hold both the decompressed chunks and their concatenation)
+        file_obj = BytesIO()
+        with open_decompressed(self.path, data=self.data) as f: # compressed files on disk are decompressed straight from disk (not read into memory first)
+            copyfileobj(f, file_obj, HASH_CHUNK_SIZE)
+        file_obj.seek(0)
+        return file_obj
 
     def __iter__(self):
         if self.children is None:
             if self.fs is None:
-                self.fs = FORMAT_TO_NIEMAFS[self.format](BytesIO(decompress(self.path, self.get_data())))
-            self.children = list()
-            fs_path_to_obj = dict()
-            for curr_path, curr_mod_time, curr_data in self.fs:
-                if curr_data is None:
-                    obj = FFM_Directory(curr_path)
-                else:
-                    obj = get_obj(path=curr_path, data=curr_data)
-                    obj.data = curr_data
-                    obj.create_time = ''
-                    if curr_mod_time is None:
-                        obj.mod_time = ''
+                file_obj = self.get_file_obj()
+                try:
+                    self.fs = FORMAT_TO_NIEMAFS[self.format](file_obj)
+                except:
+                    file_obj.close() # e.g. the archive's file on disk (if parsing fails, e.g. not actually this format)
+                    raise
+            try:
+                children = list()
+                fs_path_to_obj = dict()
+                for curr_path, curr_mod_time, curr_data in self.fs:
+                    curr_path = curr_path.as_posix()
+                    if curr_data is None:
+                        obj = FFM_Directory(curr_path)
+                        obj.children = list() # populated by its descendants below (not on disk, so can't be scanned)
+                    else:
+                        obj = get_obj(path=curr_path, data=curr_data)
+                        obj.create_time = ''
+                        if curr_mod_time is None:
+                            obj.mod_time = ''
+                        else:
+                            obj.mod_time = format_datetime(curr_mod_time)
+                    parent_path = curr_path.rpartition('/')[0] # archive paths are always POSIX
+                    if parent_path:
+                        fs_path_to_obj[parent_path].children.append(obj)
                     else:
-                        obj.mod_time = curr_mod_time.strftime(TIMESTAMP_FORMAT_STRING)
-                if '/' in str(curr_path):
-                    parent_obj = fs_path_to_obj[curr_path.parent]
-                    if parent_obj.children is None:
-                        parent_obj.children = list()
-                    parent_obj.children.append(obj)
-                else:
-                    self.children.append(obj)
-                fs_path_to_obj[curr_path] = obj
+                        children.append(obj)
+                    fs_path_to_obj[curr_path] = obj
+                self.get_format_attributes()
+                self.children = children
+            finally:
+                # niemafs has read the data of every member, so release the archive now, even if parsing failed (rather than in `to_dict`,
+                # so e.g. a directory of many archives doesn't hold a file descriptor per archive until it's written)
+                self.fs.file.close()
+                self.fs = None
         return iter(self.children)
 
-    def to_dict(self):
-        # universal NiemaFS attributes
-        out = super().to_dict() | {
-            'children': [child.to_dict() for child in self],
-        }
-
-        # ISO-specific attributes
-        if self.format == 'ISO':
-            out['physical_logical_block_size'] = self.fs.get_physical_logical_block_size()
-            out['user_data_offset'] = self.fs.get_user_data_offset()
-            out['user_data_size'] = self.fs.get_user_data_size()
-            out['logical_block_size'] = self.fs.get_logical_block_size()
-            for k, v in self.fs.parse_primary_volume_descriptor().items():
-                if k.endswith('_identifier'):
-                    out[k] = v
-                elif k.endswith('_datetime'):
-                    try:
-                        out[k] = v.strftime(TIMESTAMP_FORMAT_STRING)
-                    except:
-                        out[k] = str(v)
-
-        # GameCube-specific attributes
-        elif self.format == 'GCM':
-            gcm_boot_bin = self.fs.parse_boot_bin()
-            for k in ['game_code', 'maker_code', 'disk_id', 'version', 'game_name']:
-                out[k] = gcm_boot_bin[k]
-
-        # Wii-specific attributes
-        elif self.format == 'WII':
-            wii_header = self.fs.parse_header()
-            for k in ['game_code', 'maker_code', 'disk_id', 'version', 'game_name']:
-                out[k] = wii_header[k]
+    # get the format-specific attributes of the archive (cached, as `__iter__` releases `fs`)
+    def get_format_attributes(self):
+        if self.format_attributes is None:
+            if self.fs is None:
+                list(self) # parse the archive (which also gets these attributes)
+                return self.format_attributes
+            out = self.format_attributes = dict()
+
+            # ISO-specific attributes
+            if self.format == 'ISO':
+                out['physical_logical_block_size'] = self.fs.get_physical_logical_block_size()
+                out['user_data_offset'] = self.fs.get_user_data_offset()
+                out['user_data_size'] = self.fs.get_user_data_size()
+                out['logical_block_size'] = self.fs.get_logical_block_size()
+                for k, v in self.fs.parse_primary_volume_descriptor().items():
+                    if k.endswith('_identifier'):
+                        out[k] = v
+                    elif k.endswith('_datetime'):
+                        try:
+                            out[k] = format_datetime(v)
+                        except:
+                            out[k] = str(v)
+
+            # GameCube-specific attributes
+            elif self.format == 'GCM':
+                gcm_boot_bin = self.fs.parse_boot_bin()
+                for k in ['game_code', 'maker_code', 'disk_id', 'version', 'game_name']:
+                    out[k] = gcm_boot_bin[k]
+
+            # Wii-specific attributes
+            elif self.format == 'WII':
+                wii_header = self.fs.parse_header()
+                for k in ['game_code', 'maker_code', 'disk_id', 'version', 'game_name']:
+                    out[k] = wii_header[k]
+        return self.format_attributes
+
+    def to_dict(self, lazy=False):
+        # universal NiemaFS attributes (set up children first, as `FFM_File.to_dict` frees the data)
+        children = get_children_dicts(self, lazy=lazy)
+        out = super().to_dict(lazy=lazy)
+        out['children'] = children
+
+        # format-specific attributes
+        out.update(self.get_format_attributes())
 
         # finish up
         out['format'] = self.format
@@ -221,40 +526,79 @@ class FFM_NiemaFS(FFM_File):
 
 # class to represent ZIP files
 class FFM_ZipArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='ZIP', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        if header[:4] in {b'PK\x03\x04', b'PK\x05\x06', b'PK\x07\x08'}: # first local file header, empty archive, or split archive
+            return True
+        if get_ext(path) in COMPRESSED_EXTENSIONS: # finding the end of central directory record would mean decompressing it all, so just try parsing it
+            return True
+        return is_zipfile(path if data is None else BytesIO(data)) # data before the first header (e.g. self-extracting): check the end of central directory record like `zipfile` does
+
 # class to represent TAR files
 class FFM_TarArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='TAR', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return (header[:512] == bytes(512)) or (tarfile.TarInfo.frombuf(header[:512], 'utf-8', 'surrogateescape') is not None) # empty TAR or valid first header (raises if invalid)
+
 # class to represent ISO files
 class FFM_IsoArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='ISO', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return (ISO_LAYOUTS is None) or any(header[16*phys+off : 16*phys+off+7] == b'\x01CD001\x01' for phys, off, _ in ISO_LAYOUTS) # Primary Volume Descriptor at LBA 16
+
 # class to represent GameCube mini-DVDs
 class FFM_GcmArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='GCM', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return header[0x1C:0x20] == b'\xc2\x33\x9f\x3d' # DVD Magic Word
+
 # class to represent GameCube TGC files
 class FFM_TgcArchive(FFM_GcmArchive):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(path=path, data=data)
         self.format = 'TGC'
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return header[:4] == b'\xae\x0f\x38\xa2' # TGC Magic Word
+
 # class to represent GameCube RARS (.arc) files
 class FFM_GcRarcArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='RARC', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return header[:4] == b'RARC'
+
 # class to represent Wii DVDs
 class FFM_WiiArchive(FFM_NiemaFS):
+    __slots__ = ()
     def __init__(self, path, data=None):
         super().__init__(fmt='WII', path=path, data=data)
 
+    @classmethod
+    def sniff(cls, header, path, data=None):
+        return header[0x18:0x1C] == b'\x5d\x1c\x9e\xa3' # Wii Magic Word
+
 # map file formats to classes
 INPUT_FORMAT_TO_CLASS = {
     'ARC':  FFM_GcRarcArchive, # GameCube RARC files have .arc extension
@@ -271,26 +615,106 @@ INPUT_FORMAT_TO_CLASS = {
 if WiiFS is not None:
     INPUT_FORMAT_TO_CLASS['WII'] = FFM_WiiArchive
 
+# map lowercase file extensions (e.g. '.zip') to classes to try when automatically inferring the format (fast lookup in `get_obj`)
+SUFFIX_TO_CLASS = {'.' + k.lower(): v for k, v in INPUT_FORMAT_TO_CLASS.items() if k not in {'DIR', 'FILE'}}
+COMPRESSED_SUFFIXES = {'.' + ext.lower() for ext in COMPRESSED_EXTENSIONS}
+GET_OBJ_EXECUTOR = None # `ThreadPoolExecutor` for `FFM_Directory.__iter__` to trial-parse possible archives in parallel (only while `hash_files_parallel` walks the tree)
+
+# get the class to try for a path based on its file extension (ignoring compression), or `None` if it's not a possible archive
+def get_suffix_class(path):
+    path_without_suffix, suffix = splitext(path)
+    suffix = suffix.lower()
+    if suffix in COMPRESSED_SUFFIXES:
+        suffix = splitext(path_without_suffix)[1].lower()
+    return SUFFIX_TO_CLASS.get(suffix)
+
 # try to return the appropriate directory/file object from a given path
-def get_obj(path, data=None):
-    # input path is a directory
-    if path.is_dir():
+def get_obj(path, data=None, dir_entry=None):
+    # input path is a directory (`os.DirEntry` from `os.scandir` caches this, so use it if available; in-memory data is never a directory)
+    if (data is None) and (isdir(path) if dir_entry is None else dir_entry.is_dir()):
         return FFM_Directory(path)
 
     # try to infer class from file extension as last resort
-    ext = clean_ext(path.suffix)
-    if ext in COMPRESSED_EXTENSIONS:
-        ext = clean_ext(path.suffixes[-2])
-    if ext in INPUT_FORMAT_TO_CLASS:
+    cls = get_suffix_class(path)
+    if cls is not None:
         try:
-            tmp = INPUT_FORMAT_TO_CLASS[ext](path, data=data)
-            list(tmp) # trigger actually setting up object
-            return tmp
+            if cls.sniff(read_header(path, data=data), path, data=data): # skip the expensive parse if the magic bytes don't match
+                tmp = cls(path, data=data)
+                if dir_entry is not None:
+                    tmp.stat_result = dir_entry.stat()
+                list(tmp) # trigger actually setting up object
+                return tmp
         except:
             pass # if fails (e.g. BIN is just a binary file, not ISO), just default to FFM_File
-    return FFM_File(path, data=data)
+    tmp = FFM_File(path, data=data)
+    if dir_entry is not None:
+        tmp.stat_result = dir_entry.stat()
+    return tmp
 INPUT_FORMAT_TO_CLASS['AUTO'] = get_obj
 
+# yield all files nested within `obj` (including `obj` itself) whose hashes haven't been computed yet
+def get_unhashed_files(obj):
+    stack = [iter((obj,))] # iterators over the children of each directory/archive being visited (iterative to not hit the recursion limit)
+    while stack:
+        for obj in stack[-1]:
+            if isinstance(obj, FFM_File) and (obj.hashes is None):
+                yield obj
+            if isinstance(obj, (FFM_Directory, FFM_NiemaFS)):
+                stack.append(iter(obj))
+                break
+        else:
+            stack.pop()
+
+# compute the hashes of all files nested within `obj` in parallel
+def hash_files_parallel(obj, jobs):
+    # walk the tree to find the files to hash, trial-parsing possible archives in a pool of threads (even if not hashing, to load the tree faster)
+    # (the whole tree is loaded before anything is written, which is fine as `FFM_NiemaFS.__iter__` closes each archive once it's listed, so
+    # at most one file descriptor per thread is open at a time no matter how many archives there are)
+    # large files spend nearly all their time inside hashlib/zlib (which release the GIL), as does in-memory data (e.g. archive members,
+    # which would have to be copied to worker processes), so use threads for them; small files are dominated by Python overhead, so use processes
+    global GET_OBJ_EXECUTOR
+    threaded = list()
+    small = list()
+    GET_OBJ_EXECUTOR = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        for f in get_unhashed_files(obj):
+            if (f.data is None) and (f.get_size() < HASH_TILE_SIZE):
+                small.append(f)
+            else:
+                threaded.append(f)
+    finally:
+        GET_OBJ_EXECUTOR.shutdown()
+        GET_OBJ_EXECUTOR = None
+    if len(HASH_NAMES) == 0:
+        return
+
+    # threads: largest first, so a big file at the end doesn't leave the other threads idle
+    # (in-memory data is released right after hashing, as the size is already cached, rather than being held until `to_dict`)
+    def hash_and_release(f):
+        f.get_hashes()
+        f.data = None
+    threaded.sort(key=lambda f: f.get_size(), reverse=True)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(hash_and_release, threaded))
+
+    # processes: only paths need to be sent to worker processes
+    # group similarly-sized files (largest first), and batch them into tiles of ~`HASH_TILE_SIZE` bytes per task
+    if len(small) == 0:
+        return
+    small.sort(key=lambda f: (-f.get_size().bit_length(), f.path))
+    tiles = list()
+    tile_size = HASH_TILE_SIZE
+    for f in small:
+        if tile_size >= HASH_TILE_SIZE:
+            tiles.append(list())
+            tile_size = 0
+        tiles[-1].append(f)
+        tile_size += f.get_size()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=set_hashes, initargs=(HASH_NAMES,)) as executor: # worker processes might not inherit `set_hashes`
+        for tile, tile_hashes in zip(tiles, executor.map(hash_all_paths, [[f.path for f in tile] for tile in tiles])):
+            for f, hashes in zip(tile, tile_hashes):
+                f.hashes = hashes
+
 # parse user args
 def parse_args():
     # use argparse to parse user arguments
@@ -301,6 +725,9 @@ def parse_args():
     parser.add_argument('-oi', '--output_indent', required=False, type=int, default=None, help="Number of Spaces per Indent in Output JSON")
     parser.add_argument('-oit', '--output_indent_tab', action='store_true', help="Use Tabs (instead of spaces) for Indents in Output JSON")
     parser.add_argument('-os', '--output_sort', action='store_true', help="Sort Keys in Output JSON Alphabetically")
+    parser.add_argument('-ha', '--hashes', required=False, type=str, default=','.join(DEFAULT_HASHES), help="Comma-Separated Hash Functions to Calculate (options: %s)" % ', '.join(sorted(HASH_FUNCTIONS.keys())))
+    parser.add_argument('-nh', '--no_hashes', action='store_true', help="Don't Calculate Any Hash Functions (overrides --hashes)")
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1, help="Number of Parallel Workers for Hashing Files (0 to use all CPUs)")
     args = parser.parse_args()
 
     # check args for validity before returning
@@ -321,29 +748,46 @@ def parse_args():
             args.output_indent = '\t'
         else:
             args.output_indent = args.output_indent * '\t'
+    args.hashes = {h.strip().lower() for h in args.hashes.split(',') if h.strip()}
+    if args.no_hashes:
+        args.hashes = set()
+    elif len(args.hashes) == 0:
+        error("Must specify at least one hash function (or use --no_hashes)")
+    for h in args.hashes:
+        if h not in HASH_FUNCTIONS:
+            error("Invalid hash function (%s). Options: %s" % (h, ', '.join(sorted(HASH_FUNCTIONS.keys()))))
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    elif args.jobs < 0:
+        error("Number of parallel workers must be non-negative: %s" % args.jobs)
     return args
 
 # main content
 def main():
     # load input
     args = parse_args()
+    set_hashes(args.hashes)
     print_log("Loading Input: %s" % args.input)
     if args.input_format == 'AUTO':
         print_log("Attempting to automatically infer input format...")
-        root = get_obj(args.input)
+        root = get_obj(str(args.input))
     else:
         print_log("Using user-provided input format: %s" % args.input_format)
-        root = INPUT_FORMAT_TO_CLASS[args.input_format](args.input)
+        root = INPUT_FORMAT_TO_CLASS[args.input_format](str(args.input))
+    root.name = args.input.name # `Path.name` (e.g. '' for '.'), as `basename` of the string differs for the root
+    if args.jobs > 1:
+        print_log("Hashing files using %d parallel workers..." % args.jobs)
+        hash_files_parallel(root, args.jobs)
 
     # write output
     print_log("Writing Output: %s" % args.output)
     if args.output == 'stdout':
         from sys import stdout as output_f
     elif args.output.suffix.strip().lower() == '.gz':
-        output_f = gzip.open(args.output, 'wt')
+        output_f = TextIOWrapper(BufferedWriter(gzip_output.open(args.output, 'wb', compresslevel=OUTPUT_GZIP_COMPRESSLEVEL), buffer_size=OUTPUT_BUFFER_SIZE))
     else:
-        output_f = open(args.output, 'wt')
-    jdump(root.to_dict(), output_f, indent=args.output_indent, sort_keys=args.output_sort)
+        output_f = open(args.output, 'wt', buffering=OUTPUT_BUFFER_SIZE)
+    write_json(root.to_dict(lazy=True), output_f, indent=args.output_indent, sort_keys=args.output_sort)
     output_f.write('\n')
     output_f.close()
 